@@ -2,101 +2,226 @@
 import os
 import sys
 import logging
+import subprocess
+import zipfile
+import posixpath
 from pathlib import Path
-import fnmatch
+from concurrent.futures import ProcessPoolExecutor
+from xml.etree import ElementTree
 from openpyxl import load_workbook, Workbook
+from openpyxl.utils import get_column_letter
+from openpyxl.worksheet.dimensions import ColumnDimension
 
 # Set logging to DEBUG or INFO as needed
 logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
 
-def load_worksheet(excel_path, sheet_name):
-    wb = load_workbook(excel_path)
-    if sheet_name not in wb.sheetnames:
-        wb.create_sheet(sheet_name)
-    return wb, wb[sheet_name]
+# Fixed sheet layouts (1-based columns)
+CODEFOLDERS_HEADERS = ("Folder", "WantScan")
+FOLDER_COL, WANTSCAN_COL = 1, 2
+CODE_HEADERS = ("Path", "File", "Depth", "WantDoc")
+PATH_COL, FILE_COL, DEPTH_COL, WANTDOC_COL = 1, 2, 3, 4
+
+# File suffixes to collect (a tuple, as str.endswith requires) and directories to ignore
+SCAN_SUFFIXES = ('.js', '.css')
+HARDCODED_IGNORES = frozenset({".next", "node_modules", "archive"})
+
+# OOXML namespaces, for reading column widths straight from the xlsx package
+SHEET_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+PACKAGE_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+DOC_REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+
+def read_part_relationships(zf, part):
+    """Map relationship Id -> (type, part name) for a part of an xlsx (OOXML) package."""
+    folder, name = posixpath.split(part)
+    rels = ElementTree.fromstring(zf.read(posixpath.join(folder, '_rels', name + '.rels')))
+    targets = {}
+    for rel in rels.iter(PACKAGE_REL_NS + 'Relationship'):
+        target = rel.get('Target')
+        if target.startswith('/'):
+            target_part = target[1:]
+        else:
+            target_part = posixpath.normpath(posixpath.join(folder, target))
+        targets[rel.get('Id')] = (rel.get('Type'), target_part)
+    return targets
+
+def read_column_widths(excel_path):
+    """Return {sheet title: [(min, max, width), ...]} for column ranges with a set width."""
+    # openpyxl's read-only worksheets do not expose column_dimensions, so each sheet's
+    # <cols> block is read from the package itself, finding the sheet parts the way the
+    # OOXML spec lays them out: _rels/.rels -> workbook part -> workbook rels -> sheets.
+    # Widths are cosmetic; if the package cannot be followed, save without them.
+    column_widths = {}
+    try:
+        with zipfile.ZipFile(excel_path) as zf:
+            workbook_part = next(
+                target_part for rel_type, target_part in read_part_relationships(zf, '').values()
+                if rel_type.endswith('/officeDocument')
+            )
+            workbook_rels = read_part_relationships(zf, workbook_part)
+            workbook = ElementTree.fromstring(zf.read(workbook_part))
+            for sheet in workbook.iter(SHEET_NS + 'sheet'):
+                _, sheet_part = workbook_rels[sheet.get(DOC_REL_NS + 'id')]
+                widths = []
+                with zf.open(sheet_part) as src:
+                    # <cols> precedes <sheetData>, so parsing stops there
+                    for _, el in ElementTree.iterparse(src, events=('start',)):
+                        if el.tag == SHEET_NS + 'sheetData':
+                            break
+                        if el.tag == SHEET_NS + 'col' and el.get('width') is not None:
+                            widths.append((int(el.get('min')), int(el.get('max')), float(el.get('width'))))
+                column_widths[sheet.get('name')] = widths
+    except (KeyError, StopIteration, ValueError, ElementTree.ParseError) as e:
+        logging.warning("Could not read column widths from %s, saving without them: %s", excel_path, e)
+        return {}
+    return column_widths
+
+def read_sheets(excel_path):
+    """Read every sheet's rows as value tuples, plus its column widths, from a read-only workbook."""
+    wb = load_workbook(excel_path, read_only=True, data_only=True)
+    try:
+        # A stale stored <dimension> would make iter_rows stop early and the rewrite
+        # would then drop the unread rows; read every row instead (rows come back unpadded)
+        for ws in wb.worksheets:
+            ws.reset_dimensions()
+        sheets = {ws.title: list(ws.iter_rows(values_only=True)) for ws in wb.worksheets}
+    finally:
+        wb.close()
+    return sheets, read_column_widths(excel_path)
+
+def write_sheets(excel_path, sheets, column_widths):
+    """Write sheets of row values to excel_path through a write-only workbook.
+
+    Only values and column widths survive; other formatting is not carried over,
+    and formulas were already replaced by their cached values when read.
+    """
+    wb = Workbook(write_only=True)
+    for sheet_name, rows in sheets.items():
+        ws = wb.create_sheet(sheet_name)
+        # Column widths must be set before the first row is appended
+        for min_col, max_col, width in column_widths.get(sheet_name, []):
+            letter = get_column_letter(min_col)
+            ws.column_dimensions[letter] = ColumnDimension(ws, index=letter, width=width, min=min_col, max=max_col)
+        for row in rows:
+            ws.append(row)
+    wb.save(excel_path)
+
+def cell_value(row, col):
+    """Return the value at 1-based column col, or None if the row is shorter."""
+    return row[col-1] if len(row) >= col else None
 
 def is_git_initialized(folder_path: Path) -> bool:
     git_exists = (folder_path / '.git').exists()
     logging.debug(f"Checking git init in {folder_path}: {git_exists}")
     return git_exists
 
-def load_gitignore_patterns(folder_path: Path):
-    """Load .gitignore patterns if available."""
-    gitignore_path = folder_path / '.gitignore'
-    patterns = []
-    if gitignore_path.exists():
-        logging.info(f"Loading .gitignore from {gitignore_path}")
-        with gitignore_path.open('r', encoding='utf-8') as f:
-            for line in f:
-                line = line.strip()
-                if not line or line.startswith('#'):
-                    continue
-                patterns.append(line)
-    else:
-        logging.info(f"No .gitignore found at {folder_path}, no patterns loaded.")
-    return patterns
-
-def path_matches_patterns(path_str: str, patterns):
-    """Check if a path matches any gitignore patterns."""
-    # We'll apply fnmatch for each pattern.
-    # If a pattern ends with '/', it means a directory.
-    # We'll just use fnmatch to check either way.
-    for p in patterns:
-        if fnmatch.fnmatch(path_str, p):
-            return True
-    return False
-
-def should_skip_dir(rel_dir_str, patterns):
-    """Check if this directory should be skipped based on .gitignore patterns."""
-    # Directories like 'node_modules/' in .gitignore should skip the dir and everything inside.
-    # If any pattern matches the directory name, skip it.
-    # We'll try it as-is and also with trailing slash.
-    if path_matches_patterns(rel_dir_str + '/', patterns):
-        return True
-    return False
-
-def get_depth(root: Path, file_path: Path) -> int:
+# Resolved directory paths, kept for the life of the (worker) process
+resolved_dir_cache = {}
+
+def resolve_dir(dir_str: str) -> str:
+    """Return os.path.realpath(dir_str), resolving each directory only once."""
+    resolved = resolved_dir_cache.get(dir_str)
+    if resolved is None:
+        resolved = resolved_dir_cache[dir_str] = os.path.realpath(dir_str)
+    return resolved
+
+def resolve_file(file_str: str) -> str:
+    """Resolve a file path through its cached parent directory."""
+    parent_str, fname = os.path.split(file_str)
+    return os.path.join(resolve_dir(parent_str), fname)
+
+def get_depth(root_str: str, file_str: str) -> int:
     # Depth: number of directories between root and file (not counting the file itself)
-    return len(file_path.relative_to(root).parts) - 1
+    return file_str.removeprefix(root_str).strip(os.sep).count(os.sep)
 
-def scan_folder(root: Path, patterns):
-    """Recursively find .js and .css files, ignoring hardcoded patterns and .gitignore rules."""
-    results = []
-    logging.info(f"Scanning folder: {root}")
+def git_ls_files(root: Path, *args):
+    """Run git ls-files in root with -z and return its entries as strings."""
+    # A failure is raised, not treated as an empty folder, so main never rewrites CODE
+    # without this folder's rows and loses their WantDoc.
+    try:
+        proc = subprocess.run(
+            ['git', '-C', str(root), 'ls-files', '-z', *args],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True,
+        )
+    except subprocess.CalledProcessError as e:
+        logging.error("git ls-files failed in %s: %s", root, os.fsdecode(e.stderr).strip())
+        raise
+    except OSError as e:
+        logging.error("Could not run git in %s: %s", root, e)
+        raise
+    return [entry for entry in os.fsdecode(proc.stdout).split('\0') if entry]
 
-    # Hardcoded directories to ignore
-    hardcoded_ignores = {".next", "node_modules", "archive"}
+def scan_folder(root: Path):
+    """List .js and .css files git considers part of root, skipping hardcoded directories."""
+    logging.info(f"Scanning folder: {root}")
 
-    for dirpath, dirnames, filenames in os.walk(root):
-        rel_dir = Path(dirpath).relative_to(root)
+    # Tracked plus untracked-but-not-ignored files; git applies every .gitignore itself.
+    # git lists a submodule as one gitlink entry (mode 160000) and an untracked nested
+    # repository as one 'dir/' entry; both are collected and scanned in their own right.
+    rel_files = []
+    nested_repos = []
+    for entry in git_ls_files(root, '--cached', '--stage'):
+        meta, _, rel_file = entry.partition('\t')
+        if meta.startswith('160000 '):
+            nested_repos.append(rel_file)
+        else:
+            rel_files.append(rel_file)
+    for rel_file in git_ls_files(root, '--others', '--exclude-standard'):
+        if rel_file.endswith('/'):
+            nested_repos.append(rel_file[:-1])
+        else:
+            rel_files.append(rel_file)
 
-        # Check for hardcoded ignores
-        if any(part in hardcoded_ignores for part in rel_dir.parts):
-            logging.debug(f"Skipping hardcoded directory: {rel_dir}")
-            dirnames[:] = []  # Clear subdirs to skip descending
+    # Results are plain strings; no Path object is built per file
+    root_str = str(root)
+    results = []
+    for rel_file in rel_files:
+        # Most files are neither .js nor .css; reject them before any other work
+        if not rel_file.endswith(SCAN_SUFFIXES):
+            continue
+        # git always reports paths with '/' separators
+        if any(part in HARDCODED_IGNORES for part in rel_file.split('/')[:-1]):
+            logging.debug(f"Skipping file {rel_file} in hardcoded directory")
             continue
+        # Join with native separators so get_depth's os.sep count and the CODE keys
+        # stay correct on Windows, where git's '/' would otherwise be mixed in
+        fpath = os.path.join(root_str, rel_file.replace('/', os.sep))
+        # --cached still lists tracked files deleted from the working tree; only a few
+        # .js/.css hits reach here, so a stat each is cheap
+        if not os.path.isfile(fpath):
+            logging.debug(f"Skipping file {rel_file} missing from working tree")
+            continue
+        logging.debug(f"Found file {rel_file}")
+        results.append(fpath)
 
-        # Check if this directory should be skipped based on .gitignore
-        if str(rel_dir) != '.' and should_skip_dir(str(rel_dir), patterns):
-            logging.debug(f"Skipping directory: {rel_dir} due to .gitignore")
-            dirnames[:] = []  # Clear subdirs to skip descending
+    for rel_repo in nested_repos:
+        if any(part in HARDCODED_IGNORES for part in rel_repo.split('/')):
+            logging.debug(f"Skipping nested repository {rel_repo} in hardcoded directory")
+            continue
+        repo_path = root / rel_repo
+        # An uninitialised submodule is an empty directory; git -C there would list the parent
+        if not is_git_initialized(repo_path):
+            logging.debug(f"Skipping uninitialised submodule {rel_repo}")
             continue
+        results.extend(scan_folder(repo_path))
 
-        # Scan files in the directory
-        for filename in filenames:
-            fpath = Path(dirpath) / filename
-            rel_file = fpath.relative_to(root)
+    return results
 
-            # Check file patterns
-            if fpath.suffix in ['.js', '.css']:
-                # Check if file matches .gitignore
-                if path_matches_patterns(str(rel_file), patterns):
-                    logging.debug(f"Skipping file {rel_file} due to .gitignore")
-                    continue
-                logging.debug(f"Found file {rel_file}")
-                results.append(fpath)
+def _scan_one(folder_resolved):
+    """Scan one already-resolved CodeFolder and return its (resolved file path, record) pairs."""
+    folder_path = Path(folder_resolved)
+    if not folder_path.exists() or not folder_path.is_dir():
+        logging.warning("Folder does not exist or not a directory: %s", folder_path)
+        return []
+    if not is_git_initialized(folder_path):
+        logging.warning("Folder not git-initialized: %s", folder_path)
+        return []
 
-    return results
+    scanned_files = scan_folder(folder_path)
+    folder_records = []
+    for f in scanned_files:
+        depth = get_depth(folder_resolved, f)
+        folder_records.append((resolve_file(f), (folder_resolved, os.path.basename(f), depth)))
+    return folder_records
 
 def main():
     # Constants
@@ -108,99 +233,97 @@ def main():
     if not excel_path.exists():
         logging.error("Excel file not found: %s", excel_path)
         sys.exit(1)
-    wb, codefolders_sheet = load_worksheet(excel_path, codefolders_sheet_name)
-    if codefolders_sheet_name not in wb.sheetnames:
+    sheets, column_widths = read_sheets(excel_path)
+    if codefolders_sheet_name not in sheets:
         logging.error("No CodeFolders tab found in Excel file.")
         sys.exit(1)
-    if code_sheet_name not in wb.sheetnames:
-        wb.create_sheet(code_sheet_name)
-    code_sheet = wb[code_sheet_name]
-
-    # Read CodeFolders tab
-    headers = [cell.value for cell in codefolders_sheet[1]]
-    folder_col = None
-    wantsan_col = None
-    for idx, h in enumerate(headers, start=1):
-        if h == "Folder":
-            folder_col = idx
-        elif h == "WantScan":
-            wantsan_col = idx
-
-    if folder_col is None or wantsan_col is None:
-        logging.error("CodeFolders sheet must have Folder and WantScan columns.")
+    codefolders_rows = sheets[codefolders_sheet_name]
+    code_rows = sheets.get(code_sheet_name, [])
+
+    # Read CodeFolders tab; the layout is fixed. Checking the header row is free (it is
+    # already an in-memory tuple), so it always runs, including under python -O
+    if (not codefolders_rows or tuple(codefolders_rows[0][:2]) != CODEFOLDERS_HEADERS):
+        logging.error("CodeFolders sheet must start with Folder and WantScan columns.")
+        sys.exit(1)
+    # An existing CODE sheet in another layout is refused rather than rebuilt, since
+    # rebuilding would throw away every WantDoc selection in it
+    if code_rows and tuple(code_rows[0][:4]) != CODE_HEADERS:
+        logging.error("CODE sheet must start with Path, File, Depth and WantDoc columns.")
         sys.exit(1)
 
     codefolders = []
-    for row in codefolders_sheet.iter_rows(min_row=2, values_only=True):
-        folder_val = row[folder_col-1]
-        wantscan_val = row[wantsan_col-1]
+    for row in codefolders_rows[1:]:
+        folder_val = cell_value(row, FOLDER_COL)
+        wantscan_val = cell_value(row, WANTSCAN_COL)
         if folder_val and isinstance(wantscan_val, bool):
             codefolders.append((folder_val, wantscan_val))
 
-    # Validate git repos and scan
-    all_scanned_records = []
+    # Validate git repos and scan; each folder is independent, so scan them in parallel
+    # Folders are resolved once here and the same folder listed twice is scanned once
+    folders = []
     for folder_path_str, want_scan in codefolders:
         if not want_scan:
             logging.info(f"Skipping folder {folder_path_str} because WantScan=False")
             continue
-        folder_path = Path(folder_path_str)
-        if not folder_path.exists() or not folder_path.is_dir():
-            logging.warning("Folder does not exist or not a directory: %s", folder_path)
-            continue
-        if not is_git_initialized(folder_path):
-            logging.warning("Folder not git-initialized: %s", folder_path)
+        folder_resolved = resolve_dir(folder_path_str)
+        if folder_resolved in folders:
+            logging.info(f"Skipping folder {folder_path_str} because it is already listed")
             continue
+        folders.append(folder_resolved)
 
-        # Load .gitignore
-        patterns = load_gitignore_patterns(folder_path)
-        scanned_files = scan_folder(folder_path, patterns)
-        for f in scanned_files:
-            depth = get_depth(folder_path, f)
-            all_scanned_records.append((str(folder_path.resolve()), str(f.resolve()), f.name, depth))
+    records = {}
+    if folders:
+        with ProcessPoolExecutor(max_workers=min(len(folders), os.cpu_count() or 1)) as ex:
+            try:
+                for folder_records in ex.map(_scan_one, folders):
+                    records.update(folder_records)
+            except (OSError, subprocess.CalledProcessError):
+                logging.error("Scan failed; Excel file left unchanged.")
+                sys.exit(1)
 
     # Update CODE sheet
+    code_headers = list(code_rows[0]) if code_rows else list(CODE_HEADERS)
+    width = max(len(code_headers), len(CODE_HEADERS))
+
+    existing_rows = {
+        cell_value(row, PATH_COL): row
+        for row in code_rows[1:]
+        if cell_value(row, PATH_COL)
+    }
+
+    # Nothing to write if every scanned (path, file, depth) is already in the sheet and
+    # no listed file has gone away; rewriting the workbook is the slowest step by far
+    if code_rows:
+        old_set = {
+            (p, cell_value(row, FILE_COL), cell_value(row, DEPTH_COL))
+            for p, row in existing_rows.items()
+        }
+        new_set = {(p, fname, depth) for p, (_, fname, depth) in records.items()}
+        if new_set == old_set:
+            logging.info("No changes to CODE sheet; Excel file left as is.")
+            return
+
     logging.info("Updating CODE sheet with scanned files.")
-    code_headers = [cell.value for cell in code_sheet[1]] if code_sheet.max_row > 0 else []
-    if not code_headers or any(h not in code_headers for h in ["Path", "File", "Depth", "WantDoc"]):
-        code_sheet.delete_rows(1, code_sheet.max_row)
-        code_sheet.append(["Path", "File", "Depth", "WantDoc"])
-        code_headers = ["Path", "File", "Depth", "WantDoc"]
-
-    path_idx = code_headers.index("Path") + 1
-    file_idx = code_headers.index("File") + 1
-    depth_idx = code_headers.index("Depth") + 1
-    wantdoc_idx = code_headers.index("WantDoc") + 1
-
-    existing_rows = {}
-    for row in code_sheet.iter_rows(min_row=2, values_only=False):
-        p = row[path_idx-1].value
-        f = row[file_idx-1].value
-        d = row[depth_idx-1].value
-        w = row[wantdoc_idx-1].value
-        if p:
-            existing_rows[p] = (f, d, w)
-
-    # Clear CODE rows except header
-    code_sheet.delete_rows(2, code_sheet.max_row)
-
-    new_paths = set(r[1] for r in all_scanned_records)
-    for full_path in sorted(new_paths):
+
+    # Rows for files that still exist are carried over as they are, including WantDoc
+    # and any extra columns; only File and Depth are refreshed. Rows for files that
+    # are gone are dropped, and new files get a fresh row with WantDoc = False.
+    new_code_rows = [code_headers]
+    for full_path, (_, new_fname, new_depth) in sorted(records.items()):
         old = existing_rows.get(full_path)
-        record = next((r for r in all_scanned_records if r[1] == full_path), None)
-        if record:
-            _, _, new_fname, new_depth = record
-            if old:
-                # Keep old WantDoc
-                _, _, old_w = old
-                code_sheet.append([full_path, new_fname, new_depth, old_w])
-            else:
-                # New file, WantDoc = False
-                code_sheet.append([full_path, new_fname, new_depth, False])
+        if old is None:
+            row = [None] * width
+            row[PATH_COL-1] = full_path
+            row[WANTDOC_COL-1] = False
         else:
-            # Should not happen, since we got it from new_paths
-            pass
+            row = list(old) + [None] * (width - len(old))
+        row[FILE_COL-1] = new_fname
+        row[DEPTH_COL-1] = new_depth
+        new_code_rows.append(row)
 
-    wb.save(excel_path)
+    # Write-only workbooks cannot be edited in place, so carry the other sheets across by value
+    sheets[code_sheet_name] = new_code_rows
+    write_sheets(excel_path, sheets, column_widths)
     logging.info("Excel file updated successfully.")
 
 if __name__ == "__main__":
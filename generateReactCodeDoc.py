@@ -2,6 +2,7 @@
 import os
 import sys
 import logging
+import shutil
 from pathlib import Path
 from openpyxl import load_workbook
 
@@ -15,7 +16,8 @@ def main():
     if not excel_path.exists():
         logging.error("Excel file not found: %s", excel_path)
         sys.exit(1)
-    wb = load_workbook(excel_path)
+    # Stream both sheets once through a read-only workbook; only values are needed
+    wb = load_workbook(excel_path, read_only=True, data_only=True)
     if code_sheet_name not in wb.sheetnames:
         logging.error("CODE sheet not found in Excel file.")
         sys.exit(1)
@@ -23,23 +25,29 @@ def main():
         logging.error("CodeFolders sheet not found in Excel file.")
         sys.exit(1)
 
-    code_sheet = wb[code_sheet_name]
-    codefolders_sheet = wb[codefolders_sheet_name]
+    # A stale stored <dimension> would make iter_rows stop early and silently leave
+    # rows out of the document; read every row instead (rows come back unpadded)
+    wb[code_sheet_name].reset_dimensions()
+    wb[codefolders_sheet_name].reset_dimensions()
+    code_rows = wb[code_sheet_name].iter_rows(values_only=True)
+    codefolders_rows = wb[codefolders_sheet_name].iter_rows(values_only=True)
 
     # Load codefolders to help determine relative paths
-    cf_headers = [c.value for c in codefolders_sheet[1]]
+    cf_headers = list(next(codefolders_rows, ()))
     if "Folder" not in cf_headers:
         logging.error("CodeFolders sheet missing 'Folder' column.")
         sys.exit(1)
     folder_col = cf_headers.index("Folder") + 1
-    codefolders = []
-    for row in codefolders_sheet.iter_rows(min_row=2, values_only=True):
-        fpath = row[folder_col-1]
+    # The same folder is often listed more than once; resolve each only once
+    folder_values = set()
+    for row in codefolders_rows:
+        fpath = row[folder_col-1] if len(row) >= folder_col else None
         if fpath:
-            codefolders.append(str(Path(fpath).resolve()))
+            folder_values.add(fpath)
+    codefolders = [str(Path(fpath).resolve()) for fpath in folder_values]
 
     # Expect: Path, File, Depth, WantDoc
-    headers = [c.value for c in code_sheet[1]]
+    headers = list(next(code_rows, ()))
     try:
         path_col = headers.index("Path") + 1
         file_col = headers.index("File") + 1
@@ -50,11 +58,13 @@ def main():
         sys.exit(1)
 
     entries = []
-    for row in code_sheet.iter_rows(min_row=2, values_only=True):
-        p, f, d, w = row[path_col-1], row[file_col-1], row[depth_col-1], row[wantdoc_col-1]
+    for row in code_rows:
+        # Read-only rows stop at the last non-empty cell, so pad short rows with None
+        p, f, d, w = (row[c-1] if len(row) >= c else None for c in (path_col, file_col, depth_col, wantdoc_col))
         if p and f and d is not None and w is not None:
             if w is True:
                 entries.append((p, f, d))
+    wb.close()
 
     entries.sort(key=lambda x: x[0])
 
@@ -67,24 +77,76 @@ def main():
     # 3. Print "——>>> FOLDER : ../{that_relative_path_without_filename} <<<——" 
     #    We'll add '../' at the start to mimic the requested style.
 
-    def find_best_codefolder(file_path: Path, codefolders):
-        best_match = None
-        file_str = str(file_path)
+    # CodeFolders are stored in a trie keyed on path components, so the longest
+    # containing folder is found in one walk down the file's own path.
+    def build_codefolder_trie(codefolders):
+        trie = {}
         for cf in codefolders:
-            if file_str.startswith(cf):
-                # Pick the longest match
-                if best_match is None or len(cf) > len(best_match):
-                    best_match = cf
+            node = trie
+            for part in Path(cf).parts:
+                node = node.setdefault(part, {})
+            # None marks a node where a CodeFolder ends
+            node[None] = cf
+        return trie
+
+    def find_best_codefolder(file_path: Path, codefolder_trie):
+        best_match = None
+        node = codefolder_trie
+        for part in file_path.parts:
+            node = node.get(part)
+            if node is None:
+                break
+            # Pick the deepest match
+            best_match = node.get(None, best_match)
         return best_match
 
-    with desktop_path.open('w', encoding='utf-8') as out:
+    codefolder_trie = build_codefolder_trie(codefolders)
+
+    # Copy each file as raw bytes in 1 MiB chunks; nothing is decoded or held in memory whole.
+    # Line endings are copied as-is, so CRLF sources keep their \r\n (text mode used to turn them into \n).
+    copy_chunk_size = 1 << 20
+    # A 4 MiB output buffer keeps the many small marker and chunk writes of the
+    # copyfileobj path from each hitting the OS. The sendfile path below flushes
+    # before every file, so there it only ever holds one file's markers and the
+    # larger size buys nothing.
+    out_buffer_size = 4 * 1024 * 1024
+    users_code_marker = "——>>> users code <<<——\n".encode('utf-8')
+
+    # Where the OS allows file-to-file sendfile (Linux), copy in the kernel with no
+    # user-space buffer. Elsewhere (macOS only sends to sockets) the first failure
+    # switches every later file over to copyfileobj.
+    use_sendfile = hasattr(os, 'sendfile')
+
+    def copy_file_into(out, f):
+        nonlocal use_sendfile
+        offset = 0
+        if use_sendfile:
+            # Anything still sitting in the output buffer must land before the sendfile bytes
+            out.flush()
+            try:
+                size = os.fstat(f.fileno()).st_size
+                while offset < size:
+                    sent = os.sendfile(out.fileno(), f.fileno(), offset, size - offset)
+                    if sent == 0:
+                        break
+                    offset += sent
+                return
+            except OSError:
+                if offset == 0:
+                    use_sendfile = False
+        f.seek(offset)
+        shutil.copyfileobj(f, out, copy_chunk_size)
+
+    with desktop_path.open('wb', buffering=out_buffer_size) as out:
+        # The 5 blank lines after each file go out with the next file's markers
+        separator = b""
         for (full_path, fname, depth) in entries:
             file_path = Path(full_path)
             parent_dir = file_path.parent
 
             # Determine relative folder marker
             folder_marker = str(parent_dir)
-            best_cf = find_best_codefolder(file_path, codefolders)
+            best_cf = find_best_codefolder(file_path, codefolder_trie)
             if best_cf:
                 # Make a relative path from parent_of_best_cf's parent
                 best_cf_path = Path(best_cf)
@@ -94,20 +156,22 @@ def main():
                 # Prepend '../'
                 folder_marker = "../" + str(rel)
 
+            parts = [separator]
             if depth <= 4:
-                out.write(f"——>>> FOLDER : {folder_marker} <<<——\n")
-            out.write("——>>> users code <<<——\n")
+                parts.append(f"——>>> FOLDER : {folder_marker} <<<——\n".encode('utf-8'))
+            parts.append(users_code_marker)
+            out.write(b"".join(parts))
 
             try:
-                with file_path.open('r', encoding='utf-8') as f:
-                    file_content = f.read()
-                out.write(file_content)
+                with file_path.open('rb') as f:
+                    copy_file_into(out, f)
             except Exception as e:
                 logging.error("Error reading file %s: %s", file_path, e)
-                out.write(f"\n[Error reading file: {e}]\n")
+                out.write(f"\n[Error reading file: {e}]\n".encode('utf-8'))
 
             # Add 5 blank lines
-            out.write("\n" * 5)
+            separator = b"\n" * 5
+        out.write(separator)
 
     logging.info(f"AppReactDocument.txt created on Desktop at {desktop_path}")
 